@@ -0,0 +1,21 @@
+"""
+Benchmarks of the build pipeline in setup.py, run on synthetic repositories of
+this layout.
+
+```sh
+$ python -m benchmarks --save baseline.json
+$ python -m benchmarks --baseline baseline.json --startup-budget-ms 100
+```
+
+The import time of the package itself is measured separately:
+
+```sh
+$ python -m benchmarks.importtime --save importtime.json
+$ python -m benchmarks.importtime --baseline importtime.json --budget-ms 50
+```
+
+and so is the thread safety of the lazy exports, with `python -m benchmarks.lazy`.
+
+NOTE: this package is excluded from the distribution.
+
+"""
@@ -0,0 +1,137 @@
+"""Run the benchmarks: `python -m benchmarks --help`."""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .phases import (
+    bench_metadata,
+    bench_prune,
+    bench_readme,
+    bench_startup,
+    bench_wrap_packages,
+    scaling_exponent,
+)
+
+SCALES: Dict[str, Dict[str, List[int]]] = {
+    "quick": {
+        "submodules": [1, 10, 30],
+        "readme": [1 << 10, 100 << 10],
+        "ignored": [100, 1000],
+    },
+    "full": {
+        "submodules": [1, 10, 100, 300],
+        "readme": [1 << 10, 100 << 10, 1 << 20, 10 << 20],
+        "ignored": [100, 1000, 10000],
+    },
+}
+
+
+def run(scale: str, packages: int, repeat: int) -> List[Dict[str, Any]]:
+    """Run every phase at every size of `scale`."""
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in SCALES[scale]["submodules"]:
+            results.extend(bench_metadata(Path(tmp), n, repeat))
+            results.append(bench_wrap_packages(Path(tmp), n, packages, repeat))
+        for size in SCALES[scale]["readme"]:
+            results.append(bench_readme(size, repeat))
+        for n in SCALES[scale]["ignored"]:
+            results.extend(bench_prune(Path(tmp), n, repeat))
+        results.append(bench_startup(Path(tmp), repeat))
+    return results
+
+
+def report(results: List[Dict[str, Any]]) -> None:
+    """Print a table of the results and the scaling of each phase."""
+    order = {k: i for i, k in enumerate(dict.fromkeys(x["phase"] for x in results))}
+    results = sorted(results, key=lambda x: (order[x["phase"]], x["size"]))
+    print(f"{'phase':<16}{'size':>10}{'ms':>12}{'throughput':>28}{'peak MiB':>10}")
+    for phase, group in groupby(results, key=lambda x: x["phase"]):
+        group = list(group)
+        for x in group:
+            peak = "-" if x["peak_bytes"] is None else f"{x['peak_bytes'] / 2**20:.2f}"
+            print(
+                f"{phase:<16}{x['size']:>10}{x['seconds'] * 1000:>12.2f}"
+                f"{x['throughput']:>16.0f} {x['unit'] + '/s':<11}{peak:>10}"
+            )
+        if len(group) > 1:
+            print(f"{'':<16}scaling ~ size ** {scaling_exponent(group):.2f}")
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Find the results slower than the baseline by more than `tolerance`."""
+    old = {(x["phase"], x["size"]): x["seconds"] for x in baseline}
+    regressions = []
+    for x in results:
+        key = (x["phase"], x["size"])
+        if key in old and x["seconds"] > old[key] * tolerance:
+            regressions.append(
+                f"{x['phase']} (size={x['size']}): {x['seconds'] * 1000:.2f} ms vs "
+                f"{old[key] * 1000:.2f} ms in the baseline"
+            )
+    return regressions
+
+
+def over_budget(
+    results: List[Dict[str, Any]], phase: str, budget_ms: float
+) -> List[str]:
+    """Find the results of `phase` slower than `budget_ms`."""
+    return [
+        f"{phase} (size={x['size']}): {x['seconds'] * 1000:.2f} ms exceeds the "
+        f"budget of {budget_ms:.2f} ms"
+        for x in results
+        if x["phase"] == phase and x["seconds"] * 1000 > budget_ms
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="quick")
+    parser.add_argument("--packages", type=int, default=10, help="packages per tree")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="compare with this file")
+    parser.add_argument(
+        "--tolerance", type=float, default=1.5, help="allowed slowdown factor"
+    )
+    parser.add_argument(
+        "--startup-budget-ms",
+        type=float,
+        help="fail if `setup.py --version` takes longer than this",
+    )
+    args = parser.parse_args()
+
+    results = run(args.scale, args.packages, args.repeat)
+    report(results)
+    if args.save:
+        args.save.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+    regressions = []
+    if args.startup_budget_ms is not None:
+        regressions += over_budget(results, "startup", args.startup_budget_ms)
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions += compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION: {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Import-time benchmark of the package: `python -m benchmarks.importtime --help`.
+
+Runs `python -X importtime -c "import <module>"` in fresh interpreters, turns
+the output into a tree of per-module costs, and checks it against a baseline
+and an overall budget.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import setup
+
+__all__ = ["import_tree", "measure_import", "flatten", "report", "compare"]
+
+
+def import_tree(stderr: str) -> List[Dict[str, Any]]:
+    """
+    Parse the output of `-X importtime` into the list of top-level imports,
+    each a dict of name, self_us, cumulative_us and children. Children are
+    printed before their parent, one indentation level deeper.
+
+    """
+    pending: Dict[int, List[Dict[str, Any]]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header
+        name = name[1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        node = {
+            "name": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "children": pending.pop(level + 1, []),
+        }
+        pending.setdefault(level, []).append(node)
+    return pending.get(0, [])
+
+
+def measure_import(module: str, cwd: Path, repeat: int) -> Dict[str, Any]:
+    """
+    Import `module` in `repeat` fresh interpreters, and return the tree of the
+    fastest run.
+
+    """
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    # Compile once so that every measured run reads the same bytecode.
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=cwd, check=True)
+    best: Optional[Dict[str, Any]] = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=cwd,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        roots = [x for x in import_tree(proc.stderr) if x["name"] == module]
+        if not roots:
+            raise RuntimeError(f"{module!r} was not imported:\n{proc.stderr}")
+        if best is None or roots[-1]["cumulative_us"] < best["cumulative_us"]:
+            best = roots[-1]
+    assert best is not None
+    return best
+
+
+def flatten(node: Dict[str, Any]) -> Dict[str, int]:
+    """The cumulative cost of every module in the tree of `node`."""
+    costs = {node["name"]: node["cumulative_us"]}
+    for child in node["children"]:
+        costs.update(flatten(child))
+    return costs
+
+
+def report(node: Dict[str, Any], min_us: int, depth: int = 0) -> None:
+    """Print the tree of `node`, leaving out modules cheaper than `min_us`."""
+    if depth == 0:
+        print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    print(
+        f"{node['cumulative_us'] / 1000:>14.2f}{node['self_us'] / 1000:>10.2f}  "
+        f"{'  ' * depth}{node['name']}"
+    )
+    children = sorted(node["children"], key=lambda x: -x["cumulative_us"])
+    for child in children:
+        if child["cumulative_us"] >= min_us:
+            report(child, min_us, depth + 1)
+
+
+def compare(
+    costs: Dict[str, int], baseline: Dict[str, int], tolerance: float, min_us: int
+) -> List[str]:
+    """
+    Find the modules slower than the baseline by more than `tolerance`, or new
+    ones, ignoring those below `min_us` where timings are mostly noise.
+
+    """
+    regressions = []
+    for name, us in costs.items():
+        if us < min_us:
+            continue
+        if name not in baseline:
+            regressions.append(f"{name}: {us / 1000:.2f} ms, new import")
+        elif us > baseline[name] * tolerance:
+            regressions.append(
+                f"{name}: {us / 1000:.2f} ms vs {baseline[name] / 1000:.2f} ms "
+                "in the baseline"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime")
+    parser.add_argument(
+        "--module", help="module to import (default: SOURCE of metadata.yml)"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-us", type=int, default=200, help="noise floor")
+    parser.add_argument("--budget-ms", type=float, help="fail above this total")
+    parser.add_argument("--save", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="compare with this file")
+    parser.add_argument(
+        "--tolerance", type=float, default=1.5, help="allowed slowdown factor"
+    )
+    args = parser.parse_args()
+
+    top = Path(setup.__file__).parent
+    module = args.module or setup.BuildContext(top).yml["SOURCE"]
+    tree = measure_import(module, top, args.repeat)
+    costs = flatten(tree)
+    report(tree, args.min_us)
+    if args.save:
+        args.save.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "module": module,
+                    "tree": tree,
+                    "costs": costs,
+                },
+                indent=2,
+            )
+        )
+    failures = []
+    if args.budget_ms is not None and tree["cumulative_us"] > args.budget_ms * 1000:
+        failures.append(
+            f"import {module}: {tree['cumulative_us'] / 1000:.2f} ms exceeds the "
+            f"budget of {args.budget_ms:.2f} ms"
+        )
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["costs"]
+        failures += compare(costs, baseline, args.tolerance, args.min_us)
+    for line in failures:
+        print(f"REGRESSION: {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Stress test and contention benchmark of the lazy-export machinery in
+`_lazy.py`: `python -m benchmarks.lazy --help`.
+
+Many threads race for the first access to the exports of a synthetic lazy
+package. Every submodule must be executed exactly once and every thread must
+see the same objects. Then the cost of an access after the first load (the hot
+path) is compared with that of a plain attribute of the same package.
+
+"""
+
+import argparse
+import importlib
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import setup
+
+__all__ = ["make_lazy_package", "stress", "hot_path"]
+
+TOP = Path(setup.__file__).parent
+
+INIT = """\
+from . import _lazy
+
+EXPORTS = {exports!r}
+
+__getattr__, __dir__ = _lazy.attach(__name__, EXPORTS)
+"""
+
+MODULE = """\
+import time
+
+from . import _count
+
+time.sleep({delay})
+_count.hits.append(__name__)
+
+__all__ = {names!r}
+"""
+
+
+def make_lazy_package(
+    root: Path, name: str, modules: int, names: int, delay: float
+) -> Dict[str, str]:
+    """
+    Write a lazy package of `modules` submodules, each taking `delay` seconds to
+    import and defining `names` functions. Return its exports.
+
+    """
+    pkg = root / name
+    pkg.mkdir(parents=True)
+    src = TOP / setup.BuildContext(TOP).yml["SOURCE"]
+    shutil.copyfile(src / "_lazy.py", pkg / "_lazy.py")
+    (pkg / "_count.py").write_text("hits = []\n")
+    exports = {}
+    for i in range(modules):
+        defined = [f"f{i}_{j}" for j in range(names)]
+        body = MODULE.format(delay=delay, names=defined)
+        body += "".join(f"\n\ndef {x}():\n    return {x!r}\n" for x in defined)
+        (pkg / f"mod{i}.py").write_text(body)
+        exports.update(dict.fromkeys(defined, f"mod{i}"))
+    (pkg / "__init__.py").write_text(INIT.format(exports=exports))
+    return exports
+
+
+def stress(
+    root: Path, round_: int, threads: int, modules: int, names: int, delay: float
+) -> Dict[str, Any]:
+    """
+    Let `threads` threads access all exports of a fresh lazy package at once, in
+    random orders. Return the wall time and the problems found.
+
+    """
+    name = f"lazybench{round_}"
+    exports = make_lazy_package(root, name, modules, names, delay)
+    pkg = importlib.import_module(name)
+    count = importlib.import_module(f"{name}._count")
+    barrier = threading.Barrier(threads + 1)
+    seen: List[Dict[str, int]] = [{} for _ in range(threads)]
+    errors: List[str] = []
+
+    def worker(i: int) -> None:
+        order = list(exports)
+        random.Random(i).shuffle(order)
+        barrier.wait()
+        try:
+            for x in order:
+                seen[i][x] = id(getattr(pkg, x))
+        except Exception as e:
+            errors.append(f"thread {i}: {type(e).__name__}: {e}")
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in pool:
+        t.join()
+    seconds = time.perf_counter() - start
+
+    hits: Dict[str, int] = {}
+    for x in count.hits:
+        hits[x] = hits.get(x, 0) + 1
+    errors += [f"{x} was executed {n} times" for x, n in hits.items() if n != 1]
+    if len(hits) != modules:
+        errors.append(f"{modules - len(hits)} submodules were never executed")
+    if any(x != seen[0] for x in seen[1:]):
+        errors.append("threads saw different objects")
+    return {"seconds": seconds, "errors": errors, "package": pkg}
+
+
+def hot_path(get: Callable[[], Any], threads: int, accesses: int) -> float:
+    """Nanoseconds per call of `get`, made `accesses` times by each thread."""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker() -> None:
+        barrier.wait()
+        for _ in range(accesses):
+            get()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in pool:
+        t.join()
+    return (time.perf_counter() - start) / (threads * accesses) * 1e9
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.lazy")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--modules", type=int, default=20)
+    parser.add_argument("--names", type=int, default=10, help="exports per module")
+    parser.add_argument("--delay", type=float, default=0.005, help="import seconds")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--accesses", type=int, default=100_000)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sys.path.insert(0, tmp)
+        try:
+            for i in range(args.rounds):
+                result = stress(
+                    Path(tmp), i, args.threads, args.modules, args.names, args.delay
+                )
+                failures += result["errors"]
+                print(
+                    f"round {i}: first access by {args.threads} threads "
+                    f"{result['seconds'] * 1000:.2f} ms, "
+                    f"{len(result['errors'])} problems"
+                )
+            pkg = result["package"]
+            print(f"{'threads':>8}{'lazy export ns':>16}{'plain attr ns':>16}")
+            for threads in sorted({1, args.threads}):
+                lazy = hot_path(lambda: pkg.f0_0, threads, args.accesses)
+                plain = hot_path(lambda: pkg._count, threads, args.accesses)
+                print(f"{threads:>8}{lazy:>16.1f}{plain:>16.1f}")
+        finally:
+            sys.path.remove(tmp)
+    for line in failures:
+        print(f"FAILURE: {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
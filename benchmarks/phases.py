@@ -0,0 +1,180 @@
+"""Timed phases of the build pipeline."""
+
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import setup
+
+from .synthetic import make_readme, make_repo
+
+__all__ = [
+    "measure",
+    "bench_metadata",
+    "bench_wrap_packages",
+    "bench_readme",
+    "bench_prune",
+    "bench_startup",
+    "scaling_exponent",
+]
+
+SETUP_PY = Path(setup.__file__)
+
+
+def measure(
+    phase: str,
+    size: int,
+    units: float,
+    unit: str,
+    func: Callable[[], Any],
+    repeat: int,
+    memory: bool = True,
+) -> Dict[str, Any]:
+    """
+    Time `func` (best of `repeat` runs), then run it once more under
+    `tracemalloc` for its peak memory unless `memory` is false.
+
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        "phase": phase,
+        "size": size,
+        "seconds": best,
+        "throughput": units / best if best else math.inf,
+        "unit": unit,
+        "peak_bytes": peak,
+    }
+
+
+def bench_metadata(tmp: Path, submodules: int, repeat: int) -> List[Dict[str, Any]]:
+    """Load every metadata.yml of a repository, with a cold and a warm cache."""
+    top = make_repo(tmp / f"metadata-{submodules}", submodules=submodules)
+    files = [top / "metadata.yml"] + [
+        top / "src" / f"sub{i}" / "metadata.yml" for i in range(submodules)
+    ]
+
+    def load(cold: bool) -> None:
+        if cold:
+            shutil.rmtree(top / ".setup_cache", ignore_errors=True)
+        cache = setup._ParseCache(top / ".setup_cache" / "metadata.json", top)
+        for file in files:
+            cache.parse(file, setup._parse_yaml)
+        cache.save()
+
+    load(cold=False)
+    time.sleep(1)  # let the files leave the racy window of the cache
+    n = len(files)
+    return [
+        measure("metadata-cold", submodules, n, "files", lambda: load(True), repeat),
+        measure("metadata-warm", submodules, n, "files", lambda: load(False), repeat),
+    ]
+
+
+def bench_wrap_packages(
+    tmp: Path, submodules: int, packages: int, repeat: int
+) -> Dict[str, Any]:
+    """Resolve `packages` and `package_dir` of a repository."""
+    top = make_repo(
+        tmp / f"wrap-{submodules}-{packages}", submodules=submodules, packages=packages
+    )
+
+    def wrap() -> None:
+        ctx = setup.BuildContext(top)
+        ctx.packages
+        ctx.cache.save()
+
+    wrap()
+    total = (submodules + 1) * packages
+    return measure("wrap_packages", submodules, total, "packages", wrap, repeat)
+
+
+def bench_readme(size: int, repeat: int) -> Dict[str, Any]:
+    """Transform a README of about `size` characters."""
+    readme = "\n" + make_readme(size)
+
+    def transform() -> None:
+        setup._readme2doc(readme, "bench", ["numpy"], "https://example.com/", "BSD")
+
+    return measure("readme2doc", size, len(readme), "chars", transform, repeat)
+
+
+def bench_prune(tmp: Path, ignored: int, repeat: int) -> List[Dict[str, Any]]:
+    """
+    Walk a repository holding a git-ignored directory of `ignored` packages,
+    with and without pruning.
+
+    """
+    top = make_repo(tmp / f"prune-{ignored}")
+    vendor = top / "vendor"
+    for i in range(ignored):
+        path = vendor / f"group{i // 100}" / f"pkg{i}"
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "__init__.py").touch()
+        (path.parent / "__init__.py").touch()
+    (vendor / "__init__.py").touch()
+    (top / ".gitignore").write_text("vendor/\n")
+    rules = setup._PruneRules.from_gitignore(top, [])
+    return [
+        measure(
+            "walk-unpruned",
+            ignored,
+            ignored,
+            "dirs",
+            lambda: setup._PackageIndex(top),
+            repeat,
+        ),
+        measure(
+            "walk-pruned",
+            ignored,
+            ignored,
+            "dirs",
+            lambda: setup._PackageIndex(top, rules),
+            repeat,
+        ),
+    ]
+
+
+def bench_startup(tmp: Path, repeat: int) -> Dict[str, Any]:
+    """Run `setup.py --version` in a fresh interpreter."""
+    top = make_repo(tmp / "startup")
+    shutil.copy(SETUP_PY, top / "setup.py")
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+
+    def run() -> None:
+        subprocess.run(
+            [sys.executable, "setup.py", "--version"],
+            cwd=top,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    run()
+    return measure("startup", 1, 1, "runs", run, repeat, memory=False)
+
+
+def scaling_exponent(results: List[Dict[str, Any]]) -> float:
+    """Exponent k of a power law `seconds ~ size ** k` through the extremes."""
+    lo = min(results, key=lambda x: x["size"])
+    hi = max(results, key=lambda x: x["size"])
+    if hi["size"] == lo["size"]:
+        return math.nan
+    return math.log(hi["seconds"] / lo["seconds"]) / math.log(hi["size"] / lo["size"])
@@ -0,0 +1,113 @@
+"""Generators of synthetic repositories laid out like this one."""
+
+from pathlib import Path
+from typing import List
+
+__all__ = ["make_readme", "make_repo"]
+
+METADATA = """\
+NAME: {name}
+VERSION: 0.0.0
+SUMMARY: A synthetic package.
+HOMEPAGE: https://example.com/{name}/
+AUTHOR: bench
+AUTHOR_EMAIL: bench@example.com
+REQUIRES_PYTHON: ">=3.8.13"
+REQUIRES: []
+EXTRAS: {{}}
+SOURCE: src
+SUBMODULES: [{submodules}]
+EXCLUDES: []
+CLASSIFIERS: []
+"""
+
+README_HEAD = """\
+# bench
+A synthetic package.
+
+## Installation
+```sh
+$ pip install bench
+```
+
+## Requirements
+```txt
+numpy
+```
+
+## API
+"""
+
+README_SECTION = """\
+### func_{i}
+Describes `func_{i}()` with a line of prose long enough to be wrapped somewhere.
+```py
+>>> func_{i}()
+```
+<!--html--><table><tr><td>func_{i}</td></tr></table><!--/html-->
+
+"""
+
+README_TAIL = """\
+## See Also
+### Github repository
+* https://example.com/bench/
+
+### PyPI project
+* https://pypi.org/project/bench/
+
+## License
+BSD 3-Clause License
+
+## History
+### v0.0.0
+* Initial release.
+"""
+
+
+def make_readme(size: int) -> str:
+    """Make a README of about `size` characters in the template's format."""
+    parts = [README_HEAD]
+    length = len(README_HEAD) + len(README_TAIL)
+    i = 0
+    while length < size:
+        parts.append(README_SECTION.format(i=i))
+        length += len(parts[-1])
+        i += 1
+    parts.append(README_TAIL)
+    return "".join(parts)
+
+
+def make_repo(
+    root: Path, submodules: int = 0, packages: int = 1, readme_size: int = 1024
+) -> Path:
+    """
+    Make a repository of this layout under `root`: a `src` package with
+    `submodules` submodules at `src/sub*`, each with its own metadata.yml. Every
+    source tree holds `packages` packages.
+
+    """
+    subs: List[str] = [f"src.sub{i}" for i in range(submodules)]
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "metadata.yml").write_text(
+        METADATA.format(name="bench", submodules=", ".join(subs))
+    )
+    (root / "LICENSE").write_text("BSD 3-Clause License\n")
+    (root / "README.md").write_text(make_readme(readme_size))
+    _make_tree(root / "src", packages)
+    (root / "src" / "__version__.py").write_text('__version__ = "0.0.0"\n')
+    for sub in subs:
+        path = root / sub.replace(".", "/")
+        path.mkdir()
+        (path / "__init__.py").touch()
+        (path / "metadata.yml").write_text(METADATA.format(name=sub, submodules=""))
+        _make_tree(path / "src", packages)
+    return root
+
+
+def _make_tree(path: Path, packages: int) -> None:
+    path.mkdir(parents=True)
+    (path / "__init__.py").touch()
+    for i in range(packages - 1):
+        (path / f"pkg{i}").mkdir()
+        (path / f"pkg{i}" / "__init__.py").touch()
@@ -13,202 +13,1645 @@ $ pip install re-extensions
 
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import ast
+import atexit
+import bisect
+import hashlib
+import json
+import os
 import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from fnmatch import translate
+from functools import cached_property
 from pathlib import Path
-from typing import Any, Dict, Final, List, Optional, Tuple
-
-import yaml
-from re_extensions import rsplit, word_wrap
-from setuptools import Command, find_packages, setup
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 here = Path(__file__).parent
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Write to a temporary file in the same directory, then rename it."""
+    import tempfile
 
-# Load the package's meta-data from metadata.yml.
-yml: Dict[str, Any] = yaml.safe_load((here / "metadata.yml").read_text())
-NAME: Final[str] = yml["NAME"]
-VERSION: Final[Optional[str]] = yml["VERSION"]
-SUMMARY: Final[str] = yml["SUMMARY"]
-HOMEPAGE: Final[str] = yml["HOMEPAGE"]
-AUTHOR: Final[str] = yml["AUTHOR"]
-AUTHOR_EMAIL: Final[str] = yml["AUTHOR_EMAIL"]
-REQUIRES_PYTHON: Final[str] = yml["REQUIRES_PYTHON"]
-REQUIRES: Final[List[str]] = yml["REQUIRES"]
-EXTRAS: Final[Dict] = yml["EXTRAS"]
-SOURCE: str = yml["SOURCE"]
-LICENSE = (here / "LICENSE").read_text().partition("\n")[0]
-CLASSIFIERS: List[str] = yml["CLASSIFIERS"]
-SUBMODULES: List[str] = yml["SUBMODULES"]
-EXCLUDES: List[str] = yml["EXCLUDES"]
-
-# Import the README and use it as the long-description.
-readme_path = here / "README.md"
-try:
-    long_description = "\n" + readme_path.read_text()
-except FileNotFoundError:
-    long_description = SUMMARY
-
-
-# Load the package's __version__.py module as a dictionary.
-about = {}
-python_exec = exec
-if not VERSION:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
     try:
-        python_exec((here / SOURCE / "__version__.py").read_text(), about)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        try:
+            mode = path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~_umask
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _copy_atomic(src: Path, dst: Path) -> None:
+    """Copy `src` to a temporary file next to `dst`, then rename it."""
+    import shutil
+    import tempfile
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{dst.name}.", suffix=".tmp", dir=dst.parent)
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.chmod(tmp, 0o666 & ~_umask)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _write_if_changed(path: Path, text: str) -> bool:
+    """
+    Atomically write `text` to `path` unless the file already holds it, so that
+    unchanged files keep their mtime. Return whether the file was written.
+
+    """
+    try:
+        old = hashlib.sha256(path.read_text().encode()).digest()
     except FileNotFoundError:
-        about["__version__"] = "0.0.0"
-else:
-    about["__version__"] = VERSION
+        old = b""
+    if old == hashlib.sha256(text.encode()).digest():
+        return False
+    _atomic_write_text(path, text)
+    return True
 
 
-class UploadCommand(Command):
-    """Support setup.py upload."""
+class _ParseCache:
+    """
+    An on-disk cache of parsed files, keyed by mtime and content hash.
 
-    description = "Build and publish the package."
-    user_options = []
+    A file whose (mtime, size) stamp matches the recorded one is trusted without
+    being read. Otherwise it is read and hashed, and only parsed again when the
+    hash differs as well.
 
-    @staticmethod
-    def status(s):
-        """Print things in bold."""
-        print(f"\033[1m{s}\033[0m")
+    """
 
-    def initialize_options(self):
-        """Initialize options."""
+    version: int = 1
 
-    def finalize_options(self):
-        """Finalize options."""
+    def __init__(self, path: Path, root: Path) -> None:
+        self.path = path
+        self.root = root
+        self.dirty = False
+        self._lock = threading.Lock()
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        if data.get("version") != self.version:
+            data = {"version": self.version, "files": {}}
+        self.files: Dict[str, Dict[str, Any]] = data["files"]
 
-    def run(self):
-        """Run commands."""
-        raise NotImplementedError
+    def parse(self, file: Path, parser: Callable[[str], Any]) -> Any:
+        """Parse `file` with `parser`, or return the cached result."""
+        return self._entry(file, parser)["data"]
 
+    def digest(self, file: Path) -> str:
+        """
+        The sha256 of `file`. A cache should be used either for `parse()` or for
+        `digest()`, since the latter stores no parsed data.
 
-def _readme2doc(
-    readme: str,
-    name: str = NAME,
-    requires: List[str] = REQUIRES,
-    homepage: str = HOMEPAGE,
-    pkg_license: str = LICENSE,
-) -> Tuple[str, str]:
-    doc, rd = "", ""
-    for i, s in enumerate(rsplit("\n## ", readme)):
-        head = re.search(" .*\n", s).group()[1:-1]
-        if i == 0:
-            s = re.sub("^\n# .*", f"\n# {name}", s)
-        elif head == "Requirements":
-            s = re.sub(
-                "```txt.*```",
-                "```txt\n" + "\n".join(requires) + "\n```",
-                s,
-                flags=re.DOTALL,
+        """
+        return self._entry(file, None)["sha256"]
+
+    def _entry(self, file: Path, parser: Optional[Callable[[str], Any]]) -> Any:
+        key = os.path.relpath(file, self.root)
+        st = file.stat()
+        stamp = [st.st_mtime_ns, st.st_size]
+        entry = self.files.get(key)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry
+        raw = file.read_bytes()
+        digest = hashlib.sha256(raw).hexdigest()
+        if entry is None or entry["sha256"] != digest:
+            entry = {"sha256": digest, "data": parser and parser(raw.decode())}
+        # A file modified within the last second may change again without its
+        # stamp changing, so leave it to be hashed on the next run.
+        racy = time.time_ns() - st.st_mtime_ns < 1_000_000_000
+        entry["stamp"] = None if racy else stamp
+        with self._lock:
+            self.files[key] = entry
+            self.dirty = True
+        return entry
+
+    def save(self) -> None:
+        """
+        Write the cache back to disk if anything has changed. A cache that cannot
+        be written (e.g. on a read-only checkout, or holding YAML values such as
+        dates that JSON cannot encode) is silently dropped.
+
+        """
+        with self._lock:
+            if self.dirty:
+                data = {"version": self.version, "files": self.files}
+                try:
+                    _atomic_write_text(self.path, json.dumps(data))
+                except (OSError, TypeError, ValueError):
+                    pass
+                self.dirty = False
+
+
+def _parse_yaml(text: str) -> Any:
+    import yaml  # only needed on a cache miss
+
+    return yaml.safe_load(text)
+
+
+def _parse_version(text: str) -> str:
+    """
+    Get `__version__` from the source of `__version__.py` with `ast`, executing
+    the source only when the value is neither a literal nor built by
+    `".".join(map(str, VERSION))` from a literal.
+
+    """
+    values: Dict[str, Any] = {}
+    for node in ast.parse(text).body:
+        if not (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+        ):
+            continue
+        name, value = node.targets[0].id, node.value
+        try:
+            values[name] = ast.literal_eval(value)
+        except ValueError:
+            if (
+                isinstance(value, ast.Call)
+                and isinstance(value.func, ast.Attribute)
+                and isinstance(value.func.value, ast.Constant)
+                and value.func.attr == "join"
+                and len(value.args) == 1
+                and isinstance(arg := value.args[0], ast.Call)
+                and isinstance(arg.func, ast.Name)
+                and arg.func.id == "map"
+                and len(arg.args) == 2
+                and isinstance(arg.args[0], ast.Name)
+                and arg.args[0].id == "str"
+                and isinstance(arg.args[1], ast.Name)
+                and arg.args[1].id in values
+            ):
+                values[name] = value.func.value.value.join(
+                    map(str, values[arg.args[1].id])
+                )
+    if isinstance(values.get("__version__"), str):
+        return values["__version__"]
+    about: Dict[str, Any] = {}
+    python_exec = exec
+    python_exec(text, about)
+    return about["__version__"]
+
+
+class _Profiler:
+    """
+    Records the wall time, CPU time and tracemalloc peak of each phase of a
+    build. Phases may nest, and are named by their path, e.g. "packages/walk".
+
+    """
+
+    def __init__(self) -> None:
+        self.path: Optional[Path] = None
+        self.phases: List[Dict[str, Any]] = []
+        self._stack: List[Dict[str, Any]] = []
+
+    def enable(self, path: Path) -> None:
+        """Start profiling; the JSON report will be written to `path`."""
+        import tracemalloc
+
+        self.path = path
+        tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measure the enclosed code as the phase `name`."""
+        if self.path is None:
+            yield
+            return
+        import tracemalloc
+
+        if self._stack:
+            self._stack[-1]["peak_bytes"] = max(
+                self._stack[-1]["peak_bytes"], tracemalloc.get_traced_memory()[1]
             )
-        elif head == "Installation":
-            s = re.sub(
-                "```sh.*```", f"```sh\n$ pip install {name}\n```", s, flags=re.DOTALL
+        self._reset_peak()
+        record = {
+            "phase": "/".join([*(x["phase"] for x in self._stack[-1:]), name]),
+            "wall": -time.perf_counter(),
+            "cpu": -time.process_time(),
+            "peak_bytes": 0,
+        }
+        self.phases.append(record)
+        self._stack.append(record)
+        try:
+            yield
+        finally:
+            record["wall"] += time.perf_counter()
+            record["cpu"] += time.process_time()
+            record["peak_bytes"] = max(
+                record["peak_bytes"], tracemalloc.get_traced_memory()[1]
+            )
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]["peak_bytes"] = max(
+                    self._stack[-1]["peak_bytes"], record["peak_bytes"]
+                )
+            self._reset_peak()
+
+    @staticmethod
+    def _reset_peak() -> None:
+        import tracemalloc
+
+        if hasattr(tracemalloc, "reset_peak"):  # python>=3.9
+            tracemalloc.reset_peak()
+
+    def report(self) -> None:
+        """Write the JSON report and print a summary table to stderr."""
+        if self.path is None:
+            return
+        report = {"argv": sys.argv, "python": sys.version, "phases": self.phases}
+        _atomic_write_text(self.path, json.dumps(report, indent=2))
+        lines = [f"{'phase':<32}{'wall ms':>10}{'cpu ms':>10}{'peak MiB':>10}"]
+        for x in self.phases:
+            lines.append(
+                f"{x['phase']:<32}{x['wall'] * 1000:>10.2f}{x['cpu'] * 1000:>10.2f}"
+                f"{x['peak_bytes'] / 2**20:>10.2f}"
             )
-        elif head == "See Also":
-            pypipage = f"https://pypi.org/project/{name}/"
-            s = re.sub(
-                "### PyPI project\n.*",
-                f"### PyPI project\n* {pypipage}",
-                re.sub(
-                    "### Github repository\n.*",
-                    f"### Github repository\n* {homepage}",
-                    s,
-                ),
+        lines.append(f"Build profile written to {self.path}")
+        print("\n".join(lines), file=sys.stderr)
+
+
+profiler = _Profiler()
+
+
+def _enable_profiler(argv: List[str], top: Path) -> None:
+    """
+    Enable the profiler if `--profile-build[=PATH]` is in `argv` (removing it)
+    or if SETUP_PROFILE_BUILD is set to 1 (or true) or to a path. "", 0 and
+    false mean off.
+
+    """
+    path: Optional[str] = os.environ.get("SETUP_PROFILE_BUILD", "")
+    if path.lower() in {"", "0", "false"}:
+        path = None
+    elif path.lower() == "true":
+        path = "1"
+    for arg in [x for x in argv if x.partition("=")[0] == "--profile-build"]:
+        argv.remove(arg)
+        path = arg.partition("=")[2] or "1"
+    if path:
+        profiler.enable(top / "build" / "profile.json" if path == "1" else Path(path))
+
+
+class BuildContext:
+    """
+    The inputs of a build, each loaded on first use so that a command only pays
+    for what it needs: `setup.py --version` neither reads the README nor imports
+    setuptools.
+
+    The metadata.yml of submodules are loaded by `workers` threads, which
+    defaults to the SETUP_WORKERS environment variable, or else to the default
+    of `ThreadPoolExecutor`. Set it to 1 to load them sequentially.
+
+    """
+
+    def __init__(self, top: Path, workers: Optional[int] = None) -> None:
+        self.top = top
+        self.cache = _ParseCache(top / ".setup_cache" / "metadata.json", top)
+        if workers is None:
+            workers = int(os.environ.get("SETUP_WORKERS", 0))
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+
+    @cached_property
+    def yml(self) -> Dict[str, Any]:
+        """The package's meta-data from metadata.yml."""
+        return self.cache.parse(self.top / "metadata.yml", _parse_yaml)
+
+    @cached_property
+    def version(self) -> str:
+        """The version in metadata.yml, or else the one in __version__.py."""
+        if self.yml["VERSION"]:
+            return str(self.yml["VERSION"])
+        try:
+            return self.cache.parse(
+                self.top / self.yml["SOURCE"] / "__version__.py", _parse_version
             )
-        elif head == "License":
-            s = f"\n## License\nThis project falls under the {pkg_license}.\n"
+        except FileNotFoundError:
+            return "0.0.0"
+
+    @cached_property
+    def license(self) -> str:
+        """The first line of the LICENSE."""
+        return (self.top / "LICENSE").read_text().partition("\n")[0]
+
+    @cached_property
+    def readme(self) -> Tuple[str, str]:
+        """The module docstring and the long description made from the README."""
+        try:
+            long_description = "\n" + (self.top / "README.md").read_text()
+        except FileNotFoundError:
+            long_description = self.yml["SUMMARY"]
+        return _readme2doc(
+            long_description,
+            self.yml["NAME"],
+            self.yml["REQUIRES"],
+            self.yml["HOMEPAGE"],
+            self.license,
+        )
+
+    @cached_property
+    def packages(self) -> Tuple[List[str], Dict[str, str]]:
+        """The `packages` and `package_dir` arguments of `setup()`."""
+        return _wrap_packages(
+            self.yml["NAME"],
+            self.yml["SOURCE"],
+            self.yml["EXCLUDES"],
+            self.yml["SUBMODULES"],
+            self.top,
+            self.cache,
+            self.workers,
+            _PruneRules.from_gitignore(self.top, self.yml.get("PRUNE", [])),
+            self.top / ".setup_cache" / "layout.json",
+        )
+
+    @property
+    def package_data(self) -> Dict[str, List[str]]:
+        """The `package_data` argument of `setup()`."""
+        if not self.yml.get("LAZY_DOC", False):
+            return {}
+        return {self.yml["NAME"].replace("-", "_"): ["_doc.md"]}
+
+    def setup_kwargs(self) -> Dict[str, Any]:
+        """The keyword arguments of `setup()`."""
+        packages, package_dir = self.packages
+        return dict(
+            name=self.yml["NAME"],
+            version=self.version,
+            description=self.yml["SUMMARY"],
+            long_description=self.readme[1],
+            long_description_content_type="text/markdown",
+            author=self.yml["AUTHOR"],
+            author_email=self.yml["AUTHOR_EMAIL"],
+            python_requires=self.yml["REQUIRES_PYTHON"],
+            url=self.yml["HOMEPAGE"],
+            packages=packages,
+            package_dir=package_dir,
+            install_requires=self.yml["REQUIRES"],
+            extras_require=self.yml["EXTRAS"],
+            package_data=self.package_data,
+            include_package_data=False,
+            license=self.license.partition(" ")[0],
+            # Trove classifiers
+            # Full list: https://pypi.python.org/pypi?%3Aaction=list_classifiers
+            classifiers=self.yml["CLASSIFIERS"],
+            # $ setup.py publish support.
+            cmdclass={"upload": _upload_command()},
+        )
+
+
+def _upload_command() -> type:
+    from setuptools import Command
+
+    class UploadCommand(Command):
+        """Support setup.py upload."""
+
+        description = "Build and publish the package."
+        user_options = []
+
+        @staticmethod
+        def status(s):
+            """Print things in bold."""
+            print(f"\033[1m{s}\033[0m")
+
+        def initialize_options(self):
+            """Initialize options."""
+
+        def finalize_options(self):
+            """Finalize options."""
+
+        def run(self):
+            """Run commands."""
+            raise NotImplementedError
+
+    return UploadCommand
+
 
-        rd += s
+def _iter_lines(text: str) -> Iterator[str]:
+    """Lazy version of `text.split("\\n")`."""
+    start = 0
+    while (end := text.find("\n", start)) >= 0:
+        yield text[start:end]
+        start = end + 1
+    yield text[start:]
+
+
+def _strip_html(chunk: str, in_html: bool) -> Tuple[str, bool]:
+    """Remove the `<!--html-->` regions from a chunk of a stream."""
+    out = ""
+    while True:
+        if in_html:
+            if (i := chunk.find("<!--/html-->")) < 0:
+                return out, True
+            chunk, in_html = chunk[i + 12 :], False
+        else:
+            if (i := chunk.find("<!--html-->")) < 0:
+                return out + chunk, False
+            out, chunk, in_html = out + chunk[:i], chunk[i + 11 :], True
+
+
+def _readme2doc(
+    readme: str, name: str, requires: List[str], homepage: str, pkg_license: str
+) -> Tuple[str, str]:
+    """
+    Transform the README line by line, returning the module docstring and the
+    rewritten README. Headings are only recognised outside fenced blocks, and
+    each fenced block or html region ends at its own closing marker.
+
+    """
+    from re_extensions import word_wrap
+
+    doc: List[str] = []
+    rd: List[str] = []
+    head, replace_next = "", ""
+    in_fence = drop_fence = drop_section = in_html = False
+    for i, line in enumerate(_iter_lines(readme)):
+        chunk = "\n" + line if i else line
+        if in_fence:
+            in_fence = not line.startswith("```")
+            if drop_fence:
+                drop_fence = in_fence
+                continue
+        elif replace_next:
+            chunk, replace_next = replace_next, ""
+        elif line.startswith("## "):
+            head = line.partition(" ")[2]
+            drop_section = head == "License"
+            if drop_section:
+                chunk = f"\n## License\nThis project falls under the {pkg_license}.\n"
+                rd.append(chunk)
+                doc.append(chunk)
+                continue
+        elif line.startswith("```"):
+            in_fence = True
+            if head == "Requirements" and line.startswith("```txt"):
+                chunk = "\n```txt\n" + "\n".join(requires) + "\n```"
+                drop_fence = True
+            elif head == "Installation" and line.startswith("```sh"):
+                chunk = f"\n```sh\n$ pip install {name}\n```"
+                drop_fence = True
+        elif i == 1 and not rd[0] and line.startswith("# "):
+            chunk = f"\n# {name}"
+        elif head == "See Also" and line.rstrip() == "### Github repository":
+            replace_next = f"\n* {homepage}"
+        elif head == "See Also" and line.rstrip() == "### PyPI project":
+            replace_next = f"\n* https://pypi.org/project/{name}/"
+
+        if drop_section:
+            continue
+        rd.append(chunk)
         if head not in {"Installation", "Requirements", "History"}:
-            doc += s
-    doc = re.sub("<!--html-->.*<!--/html-->", "", doc, flags=re.DOTALL)
-    return word_wrap(doc, maximum=88) + "\n\n", rd
+            chunk, in_html = _strip_html(chunk, in_html)
+            doc.append(chunk)
+    return word_wrap("".join(doc), maximum=88) + "\n\n", "".join(rd)
 
 
 class ReadmeFormatError(Exception):
     """Raised when the README has a wrong format."""
 
 
+_MAGIC = re.compile("[*?[]")
+
+
+class ExcludeMatcher:
+    """
+    Matches names against many `fnmatch` patterns at once. Literal patterns are
+    looked up in a set, "prefix*" patterns are checked by one `str.startswith()`
+    and the rest are compiled into a single regex.
+
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        literals, prefixes, others = set(), [], []
+        for x in patterns:
+            if not _MAGIC.search(x):
+                literals.add(x)
+            elif x.endswith("*") and not _MAGIC.search(x[:-1]):
+                prefixes.append(x[:-1])
+            else:
+                others.append(translate(x))
+        self.literals = frozenset(literals)
+        self.prefixes = tuple(prefixes)
+        self.regex = re.compile("|".join(others)) if others else None
+
+    def __call__(self, name: str) -> bool:
+        return (
+            name in self.literals
+            or name.startswith(self.prefixes)
+            or (self.regex is not None and self.regex.match(name) is not None)
+        )
+
+
+class _PruneRules:
+    """
+    Directories to skip during package discovery, given by .gitignore-style
+    patterns: a pattern with a slash is matched against the path relative to
+    the top, and any other pattern against the directory's name at any depth,
+    so PRUNE entries meant for the top only must be anchored (e.g. "/build").
+    Negated patterns ("!x") are not supported and are skipped.
+
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        names, paths = [], []
+        for x in patterns:
+            x = x.strip().rstrip("/")
+            if not x or x.startswith(("#", "!")):
+                continue
+            if "/" in x:
+                paths.append(x.lstrip("/"))
+            else:
+                names.append(x)
+        self._names = ExcludeMatcher(names)
+        self._paths = ExcludeMatcher(paths)
+        self.key = hashlib.sha256(json.dumps([names, paths]).encode()).hexdigest()
+
+    @classmethod
+    def from_gitignore(cls, top: Path, extra: List[str]) -> "_PruneRules":
+        """Rules of the .gitignore under `top`, if any, plus `extra`."""
+        try:
+            patterns = (top / ".gitignore").read_text().splitlines()
+        except FileNotFoundError:
+            patterns = []
+        return cls(patterns + extra)
+
+    def __call__(self, path: str, name: str) -> bool:
+        return self._names(name) or self._paths(path)
+
+
+def _dir_stamp(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_ino]
+
+
+class _PackageIndex:
+    """
+    Every package under a directory, found in a single walk.
+
+    The walk follows the rules of `setuptools.find_packages()` and yields the
+    packages in the same order, so `find()` gives identical results without
+    walking the tree again.
+
+    """
+
+    always_exclude: Tuple[str, ...] = ("ez_setup", "*__pycache__")
+    version: int = 1
+
+    def __init__(
+        self,
+        top: Path,
+        prune: Optional[_PruneRules] = None,
+        layout: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.top = top
+        self.prune = prune
+        if layout is None:
+            # The (mtime, inode) stamps of every directory the walk looked into.
+            self.dirs: Dict[str, Optional[List[int]]] = {".": _dir_stamp(str(top))}
+            self.packages: List[str] = list(self._walk(str(top), ""))
+        else:
+            self.dirs, self.packages = layout["dirs"], layout["packages"]
+        self._sorted = sorted(self.packages)
+
+    @classmethod
+    def cached(
+        cls, top: Path, prune: Optional[_PruneRules], manifest: Path
+    ) -> "_PackageIndex":
+        """
+        The index recorded in the layout manifest at `manifest` if no directory
+        the recorded walk looked into has changed since; otherwise a new index,
+        which is then recorded.
+
+        """
+        key = prune.key if prune else ""
+        try:
+            layout = json.loads(manifest.read_text())
+            if (
+                layout["version"] == cls.version
+                and layout["key"] == key
+                and all(
+                    _dir_stamp(str(top / x)) == y for x, y in layout["dirs"].items()
+                )
+            ):
+                return cls(top, prune, layout)
+        except (OSError, ValueError, KeyError):
+            pass
+        index = cls(top, prune)
+        # A directory modified within the last second may change again without
+        # its stamp changing.
+        now = time.time_ns()
+        if all(x and now - x[0] >= 1_000_000_000 for x in index.dirs.values()):
+            layout = {
+                "version": cls.version,
+                "key": key,
+                "dirs": index.dirs,
+                "packages": index.packages,
+            }
+            try:
+                _atomic_write_text(manifest, json.dumps(layout))
+            except OSError:
+                pass  # e.g. a read-only checkout; just walk again next time
+        return index
+
+    def _walk(self, path: str, prefix: str) -> Iterator[str]:
+        children: List[Tuple[str, str]] = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if "." in entry.name or not entry.is_dir():
+                        continue
+                    package = prefix + entry.name
+                    relpath = package.replace(".", "/")
+                    if self.prune and self.prune(relpath, entry.name):
+                        continue
+                    self.dirs[relpath] = _dir_stamp(entry.path)
+                    if os.path.isfile(os.path.join(entry.path, "__init__.py")):
+                        children.append((entry.path, package))
+        except OSError:
+            return
+        for _, package in children:
+            yield package
+        for child_path, package in children:
+            yield from self._walk(child_path, package + ".")
+
+    def find(self, exclude: List[str]) -> List[str]:
+        """Like `setuptools.find_packages(exclude=exclude)`."""
+        excluded = ExcludeMatcher([*self.always_exclude, *exclude])
+        return [x for x in self.packages if not excluded(x)]
+
+    def find_under(self, package: str, exclude: List[str]) -> List[str]:
+        """Like `find()`, but only `package` and its subpackages, sorted."""
+        lo = bisect.bisect_left(self._sorted, package + ".")
+        hi = bisect.bisect_left(self._sorted, package + "/", lo)  # "/" follows "."
+        found = self._sorted[lo:hi]
+        i = bisect.bisect_left(self._sorted, package)
+        if i < len(self._sorted) and self._sorted[i] == package:
+            found.insert(0, package)
+        excluded = ExcludeMatcher([*self.always_exclude, *exclude])
+        return [x for x in found if not excluded(x)]
+
+
+class _SubmoduleResolver:
+    """
+    Resolves submodules, and the submodules of submodules, to their packages.
+
+    Submodules form a graph whose nodes are their directories. Each node is
+    resolved once and memoized, and reaching a node that is still being
+    resolved means the graph has a cycle.
+
+    """
+
+    def __init__(
+        self, index: _PackageIndex, exclude: List[str], cache: _ParseCache
+    ) -> None:
+        self.index = index
+        self.exclude = exclude
+        self.cache = cache
+        self._ymls: Dict[str, Dict[str, Any]] = {}
+        self._memo: Dict[str, Dict[str, str]] = {}
+        self._visiting: Dict[str, str] = {}
+
+    def _load(self, sub_name: str) -> Tuple[str, Dict[str, Any]]:
+        sub_dir = self.index.top / sub_name.replace(".", "/")
+        key = os.path.realpath(sub_dir)
+        if key not in self._ymls:
+            self._ymls[key] = self.cache.parse(sub_dir / "metadata.yml", _parse_yaml)
+        return key, self._ymls[key]
+
+    def prefetch(self, sub_names: List[str], workers: int) -> None:
+        """
+        Load the metadata.yml of `sub_names` and of all their submodules, one
+        level of the graph at a time, in a pool of `workers` threads. This only
+        warms up `resolve()`, whose results do not depend on it.
+
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        seen = set()
+        with ThreadPoolExecutor(workers) as pool:
+            while sub_names:
+                loaded = pool.map(self._load, sub_names)
+                next_names = []
+                for sub_name, (key, sub_yml) in zip(sub_names, loaded):
+                    if key not in seen:
+                        seen.add(key)
+                        subs = sub_yml["SUBMODULES"] or []
+                        next_names += [f"{sub_name}.{x}" for x in subs]
+                sub_names = next_names
+
+    def resolve(self, sub_name: str) -> Dict[str, str]:
+        """
+        Map the packages of the submodule at `sub_name`, a dotted path from the
+        top, to their directories. The packages are named relative to the
+        submodule: "" for its root, ".x" for its subpackage x, and so on.
+
+        As at the top, the SUBMODULES of a submodule must lie under its SOURCE,
+        which is stripped from their names: "src.inner" of the submodule "sub"
+        becomes ".inner", i.e. `<package>.sub.inner`.
+
+        """
+        key = os.path.realpath(self.index.top / sub_name.replace(".", "/"))
+        if key in self._memo:
+            return self._memo[key]
+        if key in self._visiting:
+            cycle = [*self._visiting.values(), sub_name]
+            del cycle[: list(self._visiting).index(key)]
+            raise ValueError("cyclic submodules: " + " -> ".join(cycle))
+        self._visiting[key] = sub_name
+        sub_yml = self._load(sub_name)[1]
+        sub_src = sub_yml["SOURCE"]
+        root = f"{sub_name}.{sub_src}"
+        subs = sub_yml["SUBMODULES"] or []
+        outside = [x for x in subs if not x.startswith(f"{sub_src}.")]
+        if outside:
+            raise ValueError(
+                f"submodules of {sub_name} must be under its SOURCE ({sub_src}): "
+                + ", ".join(outside)
+            )
+        children = [f"{sub_name}.{x}" for x in subs]
+        exclude = [
+            *self.exclude,
+            *(f"{sub_name}.{x}" for x in sub_yml["EXCLUDES"] or []),
+            *children,
+            *(f"{x}.*" for x in children),
+        ]
+        packages = {
+            x[len(root) :]: x.replace(".", "/")
+            for x in self.index.find_under(root, exclude)
+        }
+        for x, child in zip(subs, children):
+            wrapped = x[len(sub_src) :]
+            for suffix, path in self.resolve(child).items():
+                packages[f"{wrapped}{suffix}"] = path
+        del self._visiting[key]
+        self._memo[key] = packages
+        return packages
+
+
 def _wrap_packages(
-    name: str = NAME,
-    src: str = SOURCE,
-    exclude: List[str] = EXCLUDES,
-    submodule: List[str] = SUBMODULES,
-    top: Path = here,
+    name: str,
+    src: str,
+    exclude: List[str],
+    submodule: List[str],
+    top: Path,
+    cache: _ParseCache,
+    workers: int = 1,
+    prune: Optional[_PruneRules] = None,
+    layout: Optional[Path] = None,
 ) -> Tuple[List[str], Dict[str, str]]:
     main_name = name.replace("-", "_")
-    main_pkgs = find_packages(exclude=exclude + [x + "*" for x in submodule])
+    with profiler.phase("walk"):
+        if layout is None:
+            index = _PackageIndex(top, prune)
+        else:
+            index = _PackageIndex.cached(top, prune, layout)
+    main_pkgs = index.find(exclude + [x + "*" for x in submodule])
     pkgs = [re.sub(f"^{src}", main_name, x) for x in main_pkgs]
     pkg_dir = {main_name: src}
-    for sub_name in submodule:
-        sub_yml: Dict[str, Any] = yaml.safe_load(
-            (top / sub_name.replace(".", "/") / "metadata.yml").read_text()
-        )
-        sub_excludes: List[str] = sub_yml["EXCLUDES"]
-        sub_src: str = sub_yml["SOURCE"]
-        sub_subm: List[str] = sub_yml["SUBMODULES"]
-        if sub_subm:
-            raise ValueError(
-                "can not build submodules of a submodule: "
-                + ", ".join(f"{sub_name}.{x}" for x in sub_subm)
-            )
-        sub_pkgs = find_packages(
-            exclude=exclude
-            + main_pkgs
-            + [sub_name]
-            + [f"{sub_name}.{x}" for x in sub_excludes]
-        )
-        wrapped_pkgs = [
-            re.sub(f"^{src}", main_name, x).replace(f".{sub_src}", "") for x in sub_pkgs
-        ]
-        pkgs.extend(wrapped_pkgs)
-        for p, q in zip(wrapped_pkgs, sub_pkgs):
-            pkg_dir[p] = q.replace(".", "/")
+    with profiler.phase("submodules"):
+        resolver = _SubmoduleResolver(index, exclude, cache)
+        if workers > 1 and submodule:
+            resolver.prefetch(submodule, workers)
+        for sub_name in submodule:
+            wrapped_name = re.sub(f"^{src}", main_name, sub_name)
+            for suffix, path in resolver.resolve(sub_name).items():
+                if wrapped_name + suffix not in pkg_dir:
+                    pkgs.append(wrapped_name + suffix)
+                pkg_dir[wrapped_name + suffix] = path
     return pkgs, pkg_dir
 
 
-if __name__ == "__main__":
-    # Import the __init__.py and change the module docstring.
+def _module_path(package_dir: Path, module: str) -> Path:
+    path = package_dir / module.replace(".", "/")
+    return path / "__init__.py" if path.is_dir() else path.with_suffix(".py")
+
+
+def _public_names(path: Path) -> List[str]:
+    """
+    The names a star-import of the module at `path` would bind, found with `ast`
+    without importing anything. `__all__` may be built from literals and from
+    the `__all__` of sibling modules imported by `from . import x`.
+
+    """
+    siblings: Dict[str, Path] = {}
+
+    def resolve(value: ast.expr) -> List[str]:
+        if isinstance(value, (ast.List, ast.Tuple)):
+            return [x for elt in value.elts for x in resolve(elt)]
+        if isinstance(value, ast.Starred):
+            return resolve(value.value)
+        if isinstance(value, ast.Constant) and isinstance(value.value, str):
+            return [value.value]
+        if isinstance(value, ast.BinOp) and isinstance(value.op, ast.Add):
+            return resolve(value.left) + resolve(value.right)
+        if (
+            isinstance(value, ast.Attribute)
+            and value.attr == "__all__"
+            and isinstance(value.value, ast.Name)
+            and value.value.id in siblings
+        ):
+            return _public_names(siblings[value.value.id])
+        raise ValueError(f"can not resolve '__all__' of {path} statically")
+
+    names: List[str] = []
+    dunder_all: Optional[List[str]] = None
+    for node in ast.parse(path.read_text()).body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.append(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    continue
+                bound = alias.asname or alias.name.partition(".")[0]
+                names.append(bound)
+                if isinstance(node, ast.ImportFrom) and node.level == 1:
+                    module = ".".join(filter(None, [node.module, alias.name]))
+                    siblings[bound] = _module_path(path.parent, module)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value:
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    if target.id == "__all__":
+                        dunder_all = resolve(node.value)
+                    names.append(target.id)
+        elif (
+            isinstance(node, ast.AugAssign)
+            and isinstance(node.target, ast.Name)
+            and node.target.id == "__all__"
+            and dunder_all is not None
+        ):
+            dunder_all += resolve(node.value)
+        elif (
+            isinstance(node, ast.Expr)
+            and isinstance(node.value, ast.Call)
+            and isinstance(node.value.func, ast.Attribute)
+            and isinstance(node.value.func.value, ast.Name)
+            and node.value.func.value.id == "__all__"
+            and dunder_all is not None
+        ):
+            method, args = node.value.func.attr, node.value.args
+            if method in {"append", "extend"} and len(args) == 1:
+                dunder_all += resolve(args[0])
+            else:
+                raise ValueError(f"can not resolve '__all__' of {path} statically")
+    if dunder_all is not None:
+        return dunder_all
+    return [x for x in dict.fromkeys(names) if not x.startswith("_")]
+
+
+def _export_table(src_dir: Path) -> Dict[str, str]:
+    """
+    Map each name star-imported by the package's `__init__.py` to the module
+    defining it, by reading the sources with `ast` instead of importing them.
+
+    """
+    exports: Dict[str, str] = {}
+    for node in ast.walk(ast.parse((src_dir / "__init__.py").read_text())):
+        if (
+            isinstance(node, ast.ImportFrom)
+            and node.level == 1
+            and node.module
+            and node.names[0].name == "*"
+        ):
+            for name in _public_names(_module_path(src_dir, node.module)):
+                exports[name] = node.module
+    return exports
+
+
+def _render_exports(
+    exports: Dict[str, str], lazy: bool, lazy_doc: bool = False
+) -> str:
+    table = "".join(
+        f"\n    {json.dumps(k)}: {json.dumps(v)}," for k, v in exports.items()
+    )
+    if table:
+        table += "\n"
+    return (
+        '"""Export manifest generated by setup.py - do not edit."""\n\n'
+        "from typing import Dict\n\n"
+        f"LAZY_EXPORTS = {lazy!r}\n"
+        f"LAZY_DOC = {lazy_doc!r}\n"
+        f"EXPORTS: Dict[str, str] = {{{table}}}\n"
+    )
+
+
+def _frozen(value: Any, indent: str = "") -> str:
+    """Source code of an immutable copy of a value loaded from YAML."""
+    inner = indent + "    "
+    if isinstance(value, dict):
+        if not value:
+            return "MappingProxyType({})"
+        deeper = inner + "    "
+        items = "".join(
+            f"{deeper}{json.dumps(k)}: {_frozen(v, deeper)},\n"
+            for k, v in value.items()
+        )
+        return f"MappingProxyType(\n{inner}{{\n{items}{inner}}}\n{indent})"
+    if isinstance(value, list):
+        if not value:
+            return "()"
+        items = "".join(f"{inner}{_frozen(x, inner)},\n" for x in value)
+        return f"(\n{items}{indent})"
+    return json.dumps(value) if isinstance(value, str) else repr(value)
+
+
+# The fields of `_metadata.py`.
+_METADATA_FIELDS = [
+    "NAME",
+    "VERSION",
+    "SUMMARY",
+    "HOMEPAGE",
+    "AUTHOR",
+    "AUTHOR_EMAIL",
+    "LICENSE",
+    "REQUIRES_PYTHON",
+    "REQUIRES",
+    "EXTRAS",
+    "CLASSIFIERS",
+]
+
+
+def _render_metadata(ctx: BuildContext) -> str:
+    fields = {
+        **ctx.yml,
+        "VERSION": ctx.version,
+        "LICENSE": ctx.license.partition(" ")[0],
+    }
+    return (
+        '"""Package metadata generated by setup.py - do not edit."""\n\n'
+        "from types import MappingProxyType\n"
+        "from typing import List\n\n"
+        "__all__: List[str] = []\n\n"
+        + "".join(f"{k} = {_frozen(fields[k])}\n" for k in _METADATA_FIELDS)
+    )
+
+
+def _write_sources(ctx: BuildContext) -> None:
+    """
+    Inject the README into the module docstring of `__init__.py` (or into
+    `_doc.md` if LAZY_DOC is set), and write the export manifest, the metadata
+    module and the rewritten README.
+
+    """
+    src_dir = ctx.top / ctx.yml["SOURCE"]
     try:
-        init_path = here / SOURCE / "__init__.py"
-        module_file = init_path.read_text()
-        new_doc, long_description = _readme2doc(long_description)
-        if "'''" in new_doc and '"""' in new_doc:
-            raise ReadmeFormatError("Both \"\"\" and ''' are found in the README")
-        if '"""' in new_doc:
-            new_doc = f"'''{new_doc}'''"
-        else:
-            new_doc = f'"""{new_doc}"""'
+        module_file = (src_dir / "__init__.py").read_text()
+    except FileNotFoundError:
+        return
+    with profiler.phase("readme"):
+        new_doc, long_description = ctx.readme
+    if ctx.yml.get("LAZY_DOC", False):
+        # Only a stub is left in the source, the docstring is loaded from the
+        # package data on first access (see `_lazy.attach_doc()`).
+        _write_if_changed(src_dir / "_doc.md", new_doc)
+        new_doc = f"\n{ctx.yml['SUMMARY']}\n\nThe full docstring is in _doc.md.\n\n"
+    elif (src_dir / "_doc.md").exists():
+        (src_dir / "_doc.md").unlink()
+    if "'''" in new_doc and '"""' in new_doc:
+        raise ReadmeFormatError("Both \"\"\" and ''' are found in the README")
+    if '"""' in new_doc:
+        new_doc = f"'''{new_doc}'''"
+    else:
+        new_doc = f'"""{new_doc}"""'
+    with profiler.phase("docstring"):
         module_file = re.sub(
             "^\"\"\".*\"\"\"|^'''.*'''|^", new_doc, module_file, flags=re.DOTALL
         )
-        init_path.write_text(module_file)
-        readme_path.write_text(long_description.strip())
-    except FileNotFoundError:
-        pass
-
-    packages, package_dir = _wrap_packages()
-    # Where the magic happens.
-    setup(
-        name=NAME,
-        version=about["__version__"],
-        description=SUMMARY,
-        long_description=long_description,
-        long_description_content_type="text/markdown",
-        author=AUTHOR,
-        author_email=AUTHOR_EMAIL,
-        python_requires=REQUIRES_PYTHON,
-        url=HOMEPAGE,
-        packages=packages,
-        package_dir=package_dir,
-        install_requires=REQUIRES,
-        extras_require=EXTRAS,
-        include_package_data=False,
-        license=LICENSE.partition(" ")[0],
-        # Trove classifiers
-        # Full list: https://pypi.python.org/pypi?%3Aaction=list_classifiers
-        classifiers=CLASSIFIERS,
-        # $ setup.py publish support.
-        cmdclass={"upload": UploadCommand},
+        _write_if_changed(src_dir / "__init__.py", module_file)
+        _write_if_changed(ctx.top / "README.md", long_description.strip())
+    with profiler.phase("exports"):
+        exports = _export_table(src_dir)
+        lazy = ctx.yml.get("LAZY_EXPORTS", False)
+        lazy_doc = ctx.yml.get("LAZY_DOC", False)
+        _write_if_changed(
+            src_dir / "_exports.py", _render_exports(exports, lazy, lazy_doc)
+        )
+        _write_if_changed(src_dir / "_metadata.py", _render_metadata(ctx))
+
+
+def _package_path(package: str, package_dir: Dict[str, str]) -> str:
+    """The directory of `package`, found the way setuptools' build_py does."""
+    head, tail = package.split("."), []
+    while head:
+        if ".".join(head) in package_dir:
+            return "/".join([package_dir[".".join(head)], *tail])
+        tail.insert(0, head.pop())
+    return "/".join([package_dir[""], *tail] if "" in package_dir else tail)
+
+
+# bdist_wheel options that take a value.
+_WHEEL_VALUE_OPTIONS = {
+    "-b",
+    "--bdist-dir",
+    "-d",
+    "--dist-dir",
+    "-p",
+    "--plat-name",
+    "--python-tag",
+    "--build-number",
+    "--py-limited-api",
+    "--compression",
+    "--owner",
+    "--group",
+}
+
+
+class _WheelCache:
+    """
+    Wheels built before, stored under .setup_cache/wheels by a hash of all their
+    inputs: the resolved metadata, the transformed long description, the
+    command line, setup.py itself and every module selected by
+    `_wrap_packages()`. Files are hashed through a `_ParseCache`, so unchanged
+    ones are not read again. Only the `keep` most recently used keys are kept.
+
+    """
+
+    keep: int = 5
+
+    def __init__(self, ctx: BuildContext, args: List[str]) -> None:
+        self.ctx = ctx
+        self.args = args
+        self.hashes = _ParseCache(ctx.top / ".setup_cache" / "hashes.json", ctx.top)
+        self.dist_dir = Path("dist")
+        for i, x in enumerate(args):
+            if x in {"-d", "--dist-dir"} and i + 1 < len(args):
+                self.dist_dir = Path(args[i + 1])
+            elif x.startswith("--dist-dir="):
+                self.dist_dir = Path(x.partition("=")[2])
+
+    @staticmethod
+    def applies(args: List[str]) -> bool:
+        """Whether `args` runs bdist_wheel and no other command."""
+        if os.environ.get("SETUP_WHEEL_CACHE", "1").lower() in {"", "0", "false"}:
+            return False
+        words = []
+        for i, x in enumerate(args):
+            if x.startswith("-") or i and args[i - 1] in _WHEEL_VALUE_OPTIONS:
+                continue
+            words.append(x)
+        return words == ["bdist_wheel"]
+
+    @cached_property
+    def key(self) -> str:
+        """Hash of everything that goes into the wheel."""
+        ctx = self.ctx
+        packages, package_dir = ctx.packages
+        files = {}
+        for package in packages:
+            pkg_path = ctx.top / _package_path(package, package_dir)
+            for file in sorted(pkg_path.glob("*.py")):
+                files[os.path.relpath(file, ctx.top)] = self.hashes.digest(file)
+        inputs = {
+            "args": self.args,
+            "python": sys.version_info[0],
+            "setup": self.hashes.digest(ctx.top / "setup.py"),
+            "yml": ctx.yml,
+            "version": ctx.version,
+            "license": self.hashes.digest(ctx.top / "LICENSE"),
+            "readme": ctx.readme,
+            "files": files,
+        }
+        raw = json.dumps(inputs, sort_keys=True, default=str).encode()
+        return hashlib.sha256(raw).hexdigest()
+
+    @property
+    def path(self) -> Path:
+        return self.ctx.top / ".setup_cache" / "wheels" / self.key
+
+    def restore(self) -> bool:
+        """Copy the cached wheels into the dist dir, if there are any."""
+        wheels = sorted(self.path.glob("*.whl"))
+        if not wheels:
+            return False
+        for wheel in wheels:
+            _copy_atomic(wheel, self.dist_dir / wheel.name)
+            print(f"reusing cached {wheel.name}")
+        try:
+            os.utime(self.path)  # mark as recently used
+        except OSError:
+            pass
+        return True
+
+    def store(self, before: Dict[str, int]) -> None:
+        """
+        Keep the wheels that were written to the dist dir since `before`, and
+        evict the least recently used keys. Failing to write the cache does not
+        fail the build.
+
+        """
+        try:
+            for wheel in self.dist_dir.glob("*.whl"):
+                if before.get(wheel.name) != wheel.stat().st_mtime_ns:
+                    _copy_atomic(wheel, self.path / wheel.name)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """Remove all but the `keep` most recently used keys."""
+        import shutil
+
+        keys = sorted(
+            (x for x in self.path.parent.iterdir() if x.is_dir()),
+            key=lambda x: x.stat().st_mtime_ns,
+            reverse=True,
+        )
+        for old in keys[self.keep :]:
+            if old != self.path:
+                shutil.rmtree(old, ignore_errors=True)
+
+    def snapshot(self) -> Dict[str, int]:
+        """The wheels in the dist dir, by name and mtime."""
+        return {x.name: x.stat().st_mtime_ns for x in self.dist_dir.glob("*.whl")}
+
+
+# Display options that can be answered from metadata.yml alone. Versions that
+# setuptools would normalize are left to setuptools.
+_DISPLAY_OPTIONS: Dict[str, Callable[[BuildContext], Optional[str]]] = {
+    "--name": lambda ctx: ctx.yml["NAME"],
+    "--version": lambda ctx: ctx.version if _is_canonical(ctx.version) else None,
+    "--fullname": lambda ctx: (
+        f"{ctx.yml['NAME']}-{ctx.version}" if _is_canonical(ctx.version) else None
+    ),
+    "--description": lambda ctx: ctx.yml["SUMMARY"],
+    "--author": lambda ctx: ctx.yml["AUTHOR"],
+    "--author-email": lambda ctx: ctx.yml["AUTHOR_EMAIL"],
+    "--url": lambda ctx: ctx.yml["HOMEPAGE"],
+    "--license": lambda ctx: ctx.license.partition(" ")[0],
+    "--classifiers": lambda ctx: "\n".join(ctx.yml["CLASSIFIERS"]),
+}
+
+
+def _is_canonical(version: str) -> bool:
+    return re.fullmatch(r"(0|[1-9]\d*)(\.(0|[1-9]\d*))*", version) is not None
+
+
+def _display(ctx: BuildContext, args: List[str]) -> bool:
+    """
+    Answer a command consisting only of display options (e.g. `--version`)
+    without importing setuptools. Return False if it has to go to setuptools.
+
+    """
+    if not args or any(x not in _DISPLAY_OPTIONS for x in args):
+        return False
+    lines = [_DISPLAY_OPTIONS[x](ctx) for x in args]
+    if None in lines:
+        return False
+    print("\n".join(lines))
+    return True
+
+
+# PEP 517 build backend (see pyproject.toml). Wheels and sdists are written
+# straight from the package mapping of `_wrap_packages()`, without setuptools or
+# a build directory.
+def _dist_name(ctx: BuildContext) -> str:
+    """The distribution name as used in wheel and dist-info file names."""
+    return re.sub(r"[-_.]+", "_", ctx.yml["NAME"]).lower()
+
+
+def _dist_version(ctx: BuildContext) -> str:
+    if _is_canonical(ctx.version):
+        return ctx.version
+    from packaging.version import Version
+
+    return str(Version(ctx.version))
+
+
+def _dist_stem(ctx: BuildContext) -> str:
+    return f"{_dist_name(ctx)}-{_dist_version(ctx)}"
+
+
+def _core_metadata(ctx: BuildContext) -> str:
+    """The METADATA (or PKG-INFO) file, in core metadata version 2.1."""
+    yml = ctx.yml
+    lines = [
+        "Metadata-Version: 2.1",
+        f"Name: {yml['NAME']}",
+        f"Version: {_dist_version(ctx)}",
+        f"Summary: {yml['SUMMARY']}",
+        f"Home-page: {yml['HOMEPAGE']}",
+        f"Author: {yml['AUTHOR']}",
+        f"Author-email: {yml['AUTHOR_EMAIL']}",
+        f"License: {ctx.license.partition(' ')[0]}",
+        *(f"Classifier: {x}" for x in yml["CLASSIFIERS"]),
+        f"Requires-Python: {yml['REQUIRES_PYTHON']}",
+        "Description-Content-Type: text/markdown",
+        "License-File: LICENSE",
+        *(f"Requires-Dist: {x}" for x in yml["REQUIRES"]),
+    ]
+    for extra, requires in yml["EXTRAS"].items():
+        lines.append(f"Provides-Extra: {extra}")
+        for req in requires:
+            req, _, marker = req.partition(";")
+            marker = f"({marker.strip()}) and " if marker else ""
+            lines.append(f'Requires-Dist: {req.strip()}; {marker}extra == "{extra}"')
+    return "\n".join(lines) + "\n\n" + ctx.readme[1] + "\n"
+
+
+def _wheel_files(ctx: BuildContext) -> Iterator[Tuple[str, Path]]:
+    """The files of the wheel, as (archive name, source file) pairs."""
+    packages, package_dir = ctx.packages
+    for package in packages:
+        pkg_path = ctx.top / _package_path(package, package_dir)
+        prefix = package.replace(".", "/")
+        for file in sorted(pkg_path.glob("*.py")):
+            yield f"{prefix}/{file.name}", file
+        for name in ctx.package_data.get(package, []):
+            yield f"{prefix}/{name}", pkg_path / name
+
+
+def _dist_info(ctx: BuildContext) -> Dict[str, str]:
+    """The generated dist-info files, by name."""
+    top_level = {x.partition(".")[0] for x in ctx.packages[0]}
+    return {
+        "METADATA": _core_metadata(ctx),
+        "WHEEL": (
+            "Wheel-Version: 1.0\n"
+            f"Generator: {ctx.yml['NAME']} setup.py\n"
+            "Root-Is-Purelib: true\n"
+            "Tag: py3-none-any\n"
+        ),
+        "top_level.txt": "".join(f"{x}\n" for x in sorted(top_level)),
+        "LICENSE": (ctx.top / "LICENSE").read_text(),
+    }
+
+
+class _WheelWriter:
+    """A wheel archive that writes its own RECORD when closed."""
+
+    def __init__(self, path: Path, dist_info: str) -> None:
+        import zipfile
+
+        self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        self.dist_info = dist_info
+        self.records: List[str] = []
+        epoch = int(os.environ.get("SOURCE_DATE_EPOCH", 315532800))
+        self.date_time = time.gmtime(max(epoch, 315532800))[:6]
+
+    def write(self, arcname: str, data: bytes, mode: int = 0o644) -> None:
+        import base64
+        import zipfile
+
+        info = zipfile.ZipInfo(arcname, self.date_time)
+        info.external_attr = (0o100000 | mode) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self.zip.writestr(info, data)
+        digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=")
+        self.records.append(f"{arcname},sha256={digest.decode()},{len(data)}")
+
+    def close(self) -> None:
+        record = f"{self.dist_info}/RECORD"
+        self.records.append(f"{record},,")
+        self.write(record, "\n".join(self.records).encode() + b"\n")
+        self.zip.close()
+
+
+def _backend_context(top: Path = here) -> BuildContext:
+    ctx = BuildContext(top)
+    _write_sources(ctx)
+    return ctx
+
+
+def _build_requires() -> List[str]:
+    """Requirements beyond pyproject.toml: normalizing the version needs packaging."""
+    return [] if _is_canonical(BuildContext(here).version) else ["packaging"]
+
+
+def get_requires_for_build_wheel(config_settings: Any = None) -> List[str]:
+    return _build_requires()
+
+
+def get_requires_for_build_sdist(config_settings: Any = None) -> List[str]:
+    return _build_requires()
+
+
+def prepare_metadata_for_build_wheel(
+    metadata_directory: str, config_settings: Any = None
+) -> str:
+    ctx = _backend_context()
+    dist_info = f"{_dist_stem(ctx)}.dist-info"
+    for name, text in _dist_info(ctx).items():
+        _atomic_write_text(Path(metadata_directory) / dist_info / name, text)
+    ctx.cache.save()
+    return dist_info
+
+
+def _write_wheel(
+    stem: str,
+    dist_info: Dict[str, str],
+    wheel_directory: str,
+    contents: Iterator[Tuple[str, bytes]],
+) -> str:
+    """Write a wheel of `contents` plus the dist-info files, return its name."""
+    wheel_name = f"{stem}-py3-none-any.whl"
+    path = Path(wheel_directory) / wheel_name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wheel = _WheelWriter(path, f"{stem}.dist-info")
+    try:
+        for arcname, data in contents:
+            wheel.write(arcname, data)
+        for name, text in dist_info.items():
+            wheel.write(f"{stem}.dist-info/{name}", text.encode())
+    finally:
+        wheel.close()
+    return wheel_name
+
+
+def _compile_module(arcname: str, data: bytes) -> Tuple[str, bytes]:
+    """
+    Compile a module for the running interpreter into an unchecked hash-based
+    .pyc, which stays valid whatever mtime the installer gives the source and is
+    loaded without reading the source again.
+
+    This only pays off with installers that do not compile on their own, such as
+    uv or `pip install --no-compile`. Plain pip recompiles every module into
+    timestamp-based .pyc files over the shipped ones, listing each of them twice
+    in RECORD.
+
+    """
+    import importlib.util
+    import marshal
+
+    code = compile(data, arcname, "exec", dont_inherit=True)
+    # Flags 0b01: hash-based, not checked against the source on import.
+    header = importlib.util.MAGIC_NUMBER + (1).to_bytes(4, "little")
+    pyc = header + importlib.util.source_hash(data) + marshal.dumps(code)
+    return importlib.util.cache_from_source(arcname), pyc
+
+
+def _with_bytecode(
+    contents: List[Tuple[str, bytes]], jobs: Optional[int] = None
+) -> List[Tuple[str, bytes]]:
+    """`contents` plus the .pyc of every module, compiled in `jobs` processes."""
+    modules = [(x, data) for x, data in contents if x.endswith(".py")]
+    if jobs == 1 or len(modules) < 64:  # not worth starting a pool
+        return contents + [_compile_module(*x) for x in modules]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(jobs) as pool:
+        return contents + list(pool.map(_compile_module, *zip(*modules), chunksize=16))
+
+
+def _config_flag(config_settings: Any, name: str) -> bool:
+    value = (config_settings or {}).get(name, "false")
+    return str(value).lower() in {"1", "true", "yes", "on"}
+
+
+def build_wheel(
+    wheel_directory: str,
+    config_settings: Any = None,
+    metadata_directory: Optional[str] = None,
+) -> str:
+    ctx = _backend_context()
+    contents = [(x, file.read_bytes()) for x, file in _wheel_files(ctx)]
+    if _config_flag(config_settings, "compile"):
+        contents = _with_bytecode(contents)
+    wheel_name = _write_wheel(
+        _dist_stem(ctx), _dist_info(ctx), wheel_directory, contents
     )
+    ctx.cache.save()
+    return wheel_name
+
+
+# The import finder of editable installs. It maps every package name straight to
+# its directory, so remapped packages and submodules resolve without a sys.path
+# scan.
+_EDITABLE_FINDER = """\
+import sys
+from importlib.machinery import ModuleSpec, PathFinder
+from importlib.util import spec_from_file_location
+from pathlib import Path
+
+MAPPING = {mapping}
+
+
+class EditableFinder:
+    @classmethod
+    def find_spec(cls, fullname, path=None, target=None):
+        if fullname in MAPPING:
+            pkg_path = Path(MAPPING[fullname])
+            init = pkg_path / "__init__.py"
+            if not init.is_file():
+                spec = ModuleSpec(fullname, None, is_package=True)
+                spec.submodule_search_locations = [str(pkg_path)]
+                return spec
+            return spec_from_file_location(
+                fullname, init, submodule_search_locations=[str(pkg_path)]
+            )
+        parent = fullname.rpartition(".")[0]
+        if parent in MAPPING:
+            spec = PathFinder.find_spec(fullname, [MAPPING[parent]], target)
+            if spec is None or spec.submodule_search_locations is None:
+                return spec
+            # A subpackage not in MAPPING is excluded. Raise, or the path finder
+            # would still find it on the `__path__` of its parent.
+            raise ModuleNotFoundError(f"No module named {{fullname!r}}", name=fullname)
+        return None
+
+
+def install():
+    if EditableFinder not in sys.meta_path:
+        sys.meta_path.insert(0, EditableFinder)
+"""
+
+
+def _editable_files(ctx: BuildContext) -> Iterator[Tuple[str, bytes]]:
+    """The finder module and the .pth file that installs it."""
+    packages, package_dir = ctx.packages
+    mapping = {
+        x: str((ctx.top / _package_path(x, package_dir)).resolve()) for x in packages
+    }
+    finder = f"__editable___{_dist_name(ctx)}_finder"
+    rendered = "".join(
+        f"    {json.dumps(k)}: {json.dumps(v)},\n" for k, v in mapping.items()
+    )
+    source = _EDITABLE_FINDER.format(mapping="{\n" + rendered + "}")
+    yield f"{finder}.py", source.encode()
+    pth = f"import {finder}; {finder}.install()\n"
+    yield f"__editable__.{_dist_name(ctx)}.pth", pth.encode()
+
+
+def get_requires_for_build_editable(config_settings: Any = None) -> List[str]:
+    return _build_requires()
+
+
+def prepare_metadata_for_build_editable(
+    metadata_directory: str, config_settings: Any = None
+) -> str:
+    return prepare_metadata_for_build_wheel(metadata_directory, config_settings)
+
+
+def build_editable(
+    wheel_directory: str,
+    config_settings: Any = None,
+    metadata_directory: Optional[str] = None,
+) -> str:
+    ctx = _backend_context()
+    wheel_name = _write_wheel(
+        _dist_stem(ctx), _dist_info(ctx), wheel_directory, _editable_files(ctx)
+    )
+    ctx.cache.save()
+    return wheel_name
+
+
+def build_sdist(sdist_directory: str, config_settings: Any = None) -> str:
+    import io
+    import tarfile
+
+    ctx = _backend_context()
+    stem = _dist_stem(ctx)
+    files = {}
+    for name in ["setup.py", "pyproject.toml", "metadata.yml", "README.md", "LICENSE"]:
+        if (ctx.top / name).is_file():
+            files[name] = ctx.top / name
+    for _, file in _wheel_files(ctx):
+        rel = file.relative_to(ctx.top)
+        files[rel.as_posix()] = file
+        # Submodules are only found again through their metadata.yml.
+        for parent in rel.parents:
+            yml_file = ctx.top / parent / "metadata.yml"
+            if yml_file.is_file():
+                files[(parent / "metadata.yml").as_posix()] = yml_file
+    mtime = int(os.environ.get("SOURCE_DATE_EPOCH", time.time()))
+    sdist_name = f"{stem}.tar.gz"
+    path = Path(sdist_directory) / sdist_name
+    with tarfile.open(path, "w:gz", format=tarfile.PAX_FORMAT) as tar:
+        contents = [("PKG-INFO", _core_metadata(ctx).encode())]
+        contents += [(name, files[name].read_bytes()) for name in sorted(files)]
+        for name, data in contents:
+            info = tarfile.TarInfo(f"{stem}/{name}")
+            info.size, info.mtime, info.mode = len(data), mtime, 0o644
+            tar.addfile(info, io.BytesIO(data))
+    ctx.cache.save()
+    return sdist_name
+
+
+def _batch_prepare(
+    root: Path, dist_dir: Optional[Path], compile_bytecode: bool = False
+) -> Dict[str, Any]:
+    """
+    Run the metadata, README and layout steps for the repo at `root`, and plan
+    its wheel as plain data that can be sent to another process.
+
+    """
+    ctx = _backend_context(root)
+    plan = {
+        "stem": _dist_stem(ctx),
+        "dist_info": _dist_info(ctx),
+        "wheel_dir": str(dist_dir or root / "dist"),
+        "files": [(x, str(file)) for x, file in _wheel_files(ctx)],
+        "compile": compile_bytecode,
+    }
+    ctx.cache.save()
+    return plan
+
+
+def _batch_build(plan: Dict[str, Any]) -> Tuple[str, float]:
+    start = time.perf_counter()
+    contents = [(x, Path(file).read_bytes()) for x, file in plan["files"]]
+    if plan["compile"]:
+        # Repos are already built in parallel, so compile in this process.
+        contents = _with_bytecode(contents, jobs=1)
+    wheel = _write_wheel(plan["stem"], plan["dist_info"], plan["wheel_dir"], contents)
+    return wheel, time.perf_counter() - start
+
+
+def _batch(argv: List[str]) -> int:
+    """
+    Build the wheels of many repos made from this template with one set of
+    imports: `setup.py batch ROOT... [--jobs N] [--dist-dir DIR] [--report FILE]
+    [--compile]`.
+    Each repo is prepared in this process, and its wheel is written in a pool of
+    processes. Return the number of repos that failed.
+
+    """
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+
+    parser = argparse.ArgumentParser(prog="setup.py batch")
+    parser.add_argument("roots", nargs="+", type=Path)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("-d", "--dist-dir", type=Path)
+    parser.add_argument("--report", type=Path)
+    parser.add_argument("--compile", action="store_true")
+    args = parser.parse_args(argv)
+    results = []
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures = []
+        for root in args.roots:
+            result = {"root": str(root), "wheel": None, "error": None}
+            results.append(result)
+            start = time.perf_counter()
+            try:
+                plan = _batch_prepare(root.resolve(), args.dist_dir, args.compile)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                continue
+            finally:
+                result["prepare_seconds"] = time.perf_counter() - start
+            futures.append((result, pool.submit(_batch_build, plan)))
+        for result, future in futures:
+            try:
+                result["wheel"], result["build_seconds"] = future.result()
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+    for x in results:
+        print(f"{x['root']}: {x['error'] or x['wheel']}", file=sys.stderr)
+    if args.report is not None:
+        _atomic_write_text(args.report, json.dumps(results, indent=2) + "\n")
+    return sum(x["error"] is not None for x in results)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(min(_batch(sys.argv[2:]), 1))
+    ctx = BuildContext(here)
+    atexit.register(ctx.cache.save)
+    _enable_profiler(sys.argv, here)
+    try:
+        with profiler.phase("metadata"):
+            ctx.yml
+        if not _display(ctx, sys.argv[1:]):
+            _write_sources(ctx)
+            with profiler.phase("packages"):
+                ctx.packages
+            wheels = None
+            if _WheelCache.applies(sys.argv[1:]):
+                with profiler.phase("wheel-cache"):
+                    wheels = _WheelCache(ctx, sys.argv[1:])
+                    atexit.register(wheels.hashes.save)
+                    if wheels.restore():
+                        sys.exit()
+                    before = wheels.snapshot()
+            with profiler.phase("setuptools"):
+                from setuptools import setup
+
+                # Where the magic happens.
+                setup(**ctx.setup_kwargs())
+            if wheels is not None:
+                wheels.store(before)
+    finally:
+        profiler.report()
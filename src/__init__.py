@@ -17,9 +17,17 @@ This project falls under the BSD 3-Clause License.
 
 from typing import List
 
-from . import core
+from . import _exports, _lazy
 from .__version__ import __version__
-from .core import *
 
-__all__: List[str] = []
-__all__.extend(core.__all__)
+__all__: List[str] = list(_exports.EXPORTS)
+
+warmup = _lazy.make_warmup(__name__, _exports.EXPORTS)
+
+if _exports.LAZY_DOC:
+    _lazy.attach_doc(__name__)
+
+if _exports.LAZY_EXPORTS:
+    __getattr__, __dir__ = _lazy.attach(__name__, _exports.EXPORTS)
+else:
+    from .core import *
@@ -0,0 +1,7 @@
+"""Export manifest generated by setup.py - do not edit."""
+
+from typing import Dict
+
+LAZY_EXPORTS = False
+LAZY_DOC = False
+EXPORTS: Dict[str, str] = {}
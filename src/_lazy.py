@@ -0,0 +1,169 @@
+"""
+Contains the lazy-export machinery of $package.
+
+NOTE: this module is private. All functions and objects are available in the main
+`$package` namespace - use that instead.
+
+"""
+
+import os
+import sys
+from importlib import import_module
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+__all__: List[str] = []
+
+
+class _Loader:
+    """
+    Imports the submodules of a package on first access and publishes their
+    exports on it. Safe to use from many threads at once: the import system runs
+    each submodule exactly once, and a lock per submodule makes sure its exports
+    are published once, all together. Once published, they are plain attributes
+    of the package, so later accesses take no lock at all.
+
+    """
+
+    def __init__(self, package: str, exports: Dict[str, str]) -> None:
+        import threading  # not needed by eager packages, which never get here
+
+        self.package = package
+        self.exports = exports
+        self.names: Dict[str, List[str]] = {}
+        for name, module in exports.items():
+            self.names.setdefault(module, []).append(name)
+        self.locks = {x: threading.RLock() for x in self.names}
+        self.loaded: Dict[str, Any] = {}
+
+    def load(self, module: str) -> Any:
+        """Import the submodule `module` and publish its exports."""
+        if module in self.loaded:
+            return self.loaded[module]
+        # Imported outside the lock: the import system has its own per-module
+        # lock, and holding ours as well could deadlock on circular imports.
+        mod = import_module(f"{self.package}.{module}")
+        with self.locks[module]:
+            if module not in self.loaded:
+                values = {x: getattr(mod, x) for x in self.names[module]}
+                vars(sys.modules[self.package]).update(values)
+                self.loaded[module] = mod
+        return mod
+
+    def getattr(self, name: str) -> Any:
+        if name in self.exports:
+            self.load(self.exports[name])
+            return vars(sys.modules[self.package])[name]
+        if name in self.names:
+            return self.load(name)
+        raise AttributeError(f"module {self.package!r} has no attribute {name!r}")
+
+    def dir(self) -> List[str]:
+        return sorted({*vars(sys.modules[self.package]), *self.exports})
+
+    def warmup(self, modules: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Import the exported submodules (or only `modules`) and their exports,
+        then collect and freeze the garbage collector's heap, so that processes
+        forked afterwards share them instead of each loading and copying them.
+        Call this in the parent process before forking.
+
+        Parameters
+        ----------
+        modules : Iterable[str], optional
+            Names of the submodules to import, by default all of them.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The newly loaded modules under "modules", and the time taken in
+            seconds under "seconds".
+
+        """
+        import gc
+        import time
+
+        start = time.perf_counter()
+        before = set(sys.modules)
+        for module in sorted(self.names if modules is None else set(modules)):
+            if module in self.names:
+                self.load(module)
+            else:
+                import_module(f"{self.package}.{module}")
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        return {
+            "modules": sorted(set(sys.modules) - before),
+            "seconds": time.perf_counter() - start,
+        }
+
+
+_loaders: Dict[str, _Loader] = {}
+
+
+def _loader(package: str, exports: Dict[str, str]) -> _Loader:
+    if package not in _loaders:
+        _loaders[package] = _Loader(package, exports)
+    return _loaders[package]
+
+
+def attach(
+    package: str, exports: Dict[str, str]
+) -> Tuple[Callable[[str], Any], Callable[[], List[str]]]:
+    """
+    Make the module-level `__getattr__()` and `__dir__()` (PEP 562) of a package
+    whose exports, a mapping from names to the submodules defining them, are
+    imported on first access.
+
+    """
+    loader = _loader(package, exports)
+    return loader.getattr, loader.dir
+
+
+def make_warmup(
+    package: str, exports: Dict[str, str]
+) -> Callable[[Optional[Iterable[str]]], Dict[str, Any]]:
+    """
+    Make the `warmup()` function of a package, see its docstring. The loader is
+    only built when it is first called.
+
+    """
+
+    def warmup(modules: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        return _loader(package, exports).warmup(modules)
+
+    warmup.__doc__ = _Loader.warmup.__doc__
+    return warmup
+
+
+_docs: Dict[str, Optional[str]] = {}
+
+
+# A module whose docstring is read from the `_doc.md` next to it when first
+# needed. (A class docstring here would be shadowed by the property anyway.)
+class _LazyDocModule(ModuleType):
+    @property
+    def __doc__(self) -> Optional[str]:
+        if self.__name__ not in _docs:
+            path = os.path.join(os.path.dirname(self.__file__), "_doc.md")
+            try:
+                _docs[self.__name__] = self.__spec__.loader.get_data(path).decode()
+            except OSError:
+                _docs[self.__name__] = vars(self).get("__doc__")
+        return _docs[self.__name__]
+
+    @__doc__.setter
+    def __doc__(self, value: Optional[str]) -> None:
+        _docs[self.__name__] = value
+
+
+def attach_doc(package: str) -> None:
+    """
+    Make the docstring of a package load from its `_doc.md` (written by setup.py
+    when LAZY_DOC is set) when it is first needed (e.g. by `help()`). With -OO,
+    docstrings are stripped and this does nothing.
+
+    """
+    if sys.flags.optimize < 2:
+        sys.modules[package].__class__ = _LazyDocModule
@@ -0,0 +1,27 @@
+"""Package metadata generated by setup.py - do not edit."""
+
+from types import MappingProxyType
+from typing import List
+
+__all__: List[str] = []
+
+NAME = "$package"
+VERSION = "0.0.0"
+SUMMARY = "A template repository for building python packages."
+HOMEPAGE = "https://github.com/Chitaoji/$package/"
+AUTHOR = "Chitaoji"
+AUTHOR_EMAIL = "2360742040@qq.com"
+LICENSE = "BSD"
+REQUIRES_PYTHON = ">=3.8.13"
+REQUIRES = ()
+EXTRAS = MappingProxyType({})
+CLASSIFIERS = (
+    "License :: OSI Approved :: BSD License",
+    "Programming Language :: Python",
+    "Programming Language :: Python :: 3",
+    "Programming Language :: Python :: 3.8",
+    "Programming Language :: Python :: 3.9",
+    "Programming Language :: Python :: 3.10",
+    "Programming Language :: Python :: 3.11",
+    "Programming Language :: Python :: 3.12",
+)